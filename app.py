@@ -5,10 +5,14 @@
 import os
 import sys
 from datetime import datetime
+from itertools import chain
 
+import orjson
 from bson.objectid import ObjectId
-from flask import Flask, jsonify, request
+from flask import Flask, request
 from flask_pymongo import PyMongo
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
 
 # Add the current directory to the path to ensure legacy_parser can be found
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -22,6 +26,101 @@ app.config['MONGO_URI'] = 'mongodb://localhost:27017/school'
 # Initialize MongoDB connection (connect app to MongoDB)
 mongo = PyMongo(app)
 
+
+# Indexes backing the student_id / task_id lookups: (collection, field, unique)
+_INDEXES = (
+    ('students', 'student_id', True),
+    ('student_tasks', 'task_id', True),
+    ('student_tasks', 'student_id', False),
+)
+# Server selection timeout for index creation, so a MongoDB outage only delays startup briefly
+INDEX_TIMEOUT_MS = 2000
+
+
+def _ensure_indexes():
+    """Creates the _INDEXES (idempotent, safe on every boot)."""
+    # Short-lived client with a short timeout: the shared client would block every worker's
+    # import for PyMongo's default 30 s server selection timeout when MongoDB is down
+    with MongoClient(app.config['MONGO_URI'], serverSelectionTimeoutMS=INDEX_TIMEOUT_MS) as client:
+        db = client.get_default_database()
+        for collection, field, unique in _INDEXES:
+            try:
+                db[collection].create_index(field, unique=unique)
+            except ConnectionFailure as e:
+                # Don't prevent the app (and the legacy endpoints) from starting without MongoDB
+                print(f"Warning: could not create MongoDB indexes: {e}")
+                return
+            except PyMongoError as e:
+                # e.g. existing duplicate values; the remaining indexes are still created
+                print(f"Warning: could not create index on {collection}.{field}: {e}")
+
+
+_ensure_indexes()
+
+# Date format expected for all incoming date strings
+DATE_FORMAT = "%Y-%m-%d"
+_fromisoformat = datetime.fromisoformat
+
+
+def _parse_date(value):
+    """Parses a 'YYYY-MM-DD' string into a datetime.
+
+    fromisoformat is a direct C parser, much cheaper than strptime re-reading the format string;
+    anything not shaped like 'YYYY-MM-DD' still goes through strptime for strict validation.
+    """
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return _fromisoformat(value)
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def _fields_projection(value):
+    """Builds a find() projection from a comma separated ?fields= value (None for all fields).
+
+    Raises ValueError for names MongoDB would reject: empty or '$'-prefixed path components,
+    and paths that collide with another listed path (e.g. 'a' and 'a.b').
+    """
+    fields = list(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    if not fields:
+        return None
+    for field in fields:
+        if any(not part or part.startswith('$') for part in field.split('.')):
+            raise ValueError(f'Invalid field name: {field}')
+        for other in fields:
+            if other.startswith(field + '.'):
+                raise ValueError(f'Field {other} collides with field {field}')
+    projection = {f: 1 for f in fields}
+    projection.setdefault('_id', 0)
+    return projection
+
+
+# Helper function to build a JSON response
+def _json_response(obj, status=200):
+    """Serializes obj with orjson (datetime natively, ObjectId via str), bypassing Flask's jsonify."""
+    return app.response_class(
+        orjson.dumps(obj, default=str, option=orjson.OPT_NAIVE_UTC),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+# Helper function to stream documents as newline-delimited JSON
+def _ndjson_response(docs):
+    """Streams docs (e.g. a MongoDB cursor) as NDJSON, encoding one document at a time.
+
+    A cursor only runs its query when first iterated, so the first document is fetched before
+    the response is built: a rejected query or an unreachable server raises here, while an error
+    status can still be sent, instead of cutting off a stream that already started with a 200.
+    """
+    docs = iter(docs)
+    first = next(docs, None)
+
+    def generate():
+        if first is None:
+            return
+        for doc in chain((first,), docs):
+            yield orjson.dumps(doc, default=str, option=orjson.OPT_NAIVE_UTC | orjson.OPT_APPEND_NEWLINE)
+    return app.response_class(generate(), status=200, mimetype='application/x-ndjson')
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ API Methods for the Legacy Data Adapter (Pick/Universe Simulation) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 @app.route('/get_legacy_client/<client_id>', methods=['GET'])
@@ -30,18 +129,19 @@ def get_legacy_client(client_id):
     Retrieves data from the simulated Pick/Universe flat file.
     This demonstrates understanding of Dynamic Arrays and Unibasic logic.
     """
-    # 1. Simulate the READ operation on the Legacy Flat File
-    client_record = PickRecord.read(client_id)
-    
-    # 2. Check if the record was found (i.e., the key exists)
-    if client_record.raw_data:
-        # Query params controls: parse_numbers, parse_dates, latest
-        parse_numbers = request.args.get('parse_numbers', 'true').lower() != 'false'
-        parse_dates = request.args.get('parse_dates', 'true').lower() != 'false'
-        latest = request.args.get('latest', 'last')
-        # 3. Use the PickRecord class to EXTRACT attributes and convert the structure
-        client_data = client_record.to_json(parse_numbers=parse_numbers, parse_dates=parse_dates, latest_balance=latest)
-        return jsonify(client_data), 200
+    # Query params controls: parse_numbers, parse_dates, latest
+    parse_numbers = request.args.get('parse_numbers', 'true').lower() != 'false'
+    parse_dates = request.args.get('parse_dates', 'true').lower() != 'false'
+    latest = request.args.get('latest', 'last')
+
+    # Simulate the READ operation on the Legacy Flat File and EXTRACT/convert its attributes.
+    # The encoded JSON is cached by PickRecord until the record (or the file) changes.
+    client_data = PickRecord.read_json(client_id, parse_numbers=parse_numbers, parse_dates=parse_dates,
+                                       latest_balance=latest)
+
+    # Check if the record was found (i.e., the key exists)
+    if client_data is not None:
+        return app.response_class(client_data, status=200, mimetype='application/json')
     else:
         # Return a 404 if the key (ID) was not found in the flat file
         return not_found()
@@ -63,9 +163,8 @@ def add_student():
     _isDeleted = _json["is_deleted"]
 
     # Parse the date string from the request and convert it into a Python datetime object
-    date_format = "%Y-%m-%d"
-    _created = datetime.strptime(_json["created"], date_format)
-    _lastUpdated = datetime.strptime(_json["last_updated"], date_format)
+    _created = _parse_date(_json["created"])
+    _lastUpdated = _parse_date(_json["last_updated"])
 
     _createdBy = _json["created_by"]
     _lastUpdatedBy = _json["last_updated_by"]
@@ -75,26 +174,29 @@ def add_student():
         
         # Inserting the variables into the "students" database
         # Removed 'id =' assignment as it's not used immediately, improved insert for clarity
-        mongo.db.students.insert_one(
-            {'student_id': _studentId, 
-             'first_name': _fName, 
-             'last_name': _lName,
-             'age': _age,
-             'gender': _gender,
-             'image': _imageURL,
-             'active': _active,
-             'is_deleted': _isDeleted,
-             'created': _created,
-             'created_by': _createdBy,
-             'last_updated': _lastUpdated,
-             'last_updated_by': _lastUpdatedBy
-             }
-             )
+        try:
+            mongo.db.students.insert_one(
+                {'student_id': _studentId, 
+                 'first_name': _fName, 
+                 'last_name': _lName,
+                 'age': _age,
+                 'gender': _gender,
+                 'image': _imageURL,
+                 'active': _active,
+                 'is_deleted': _isDeleted,
+                 'created': _created,
+                 'created_by': _createdBy,
+                 'last_updated': _lastUpdated,
+                 'last_updated_by': _lastUpdatedBy
+                 }
+                 )
+        except DuplicateKeyError:
+            return _json_response({'message': f'A student with student_id {_studentId} already exists'}, 409)
         # Generate a response
-        response = jsonify("Student added successfully!")
+        response = _json_response("Student added successfully!")
 
-        # Return the response and status code
-        return response, 200
+        # Return the response (status code 200)
+        return response
 
     else:
         return not_found()
@@ -103,12 +205,30 @@ def add_student():
 # Changing route to a POST (add) request to add multiple students
 @app.route('/add_students', methods=['POST'])
 def add_students():
-    students_list = request.json  # Store and convert incoming JSON from the request
+    """
+    Inserts a list of students in a single bulk write.
+    The insert is unordered: MongoDB may apply the documents in any order and keeps inserting
+    the remaining ones when one fails (e.g. a duplicate key), so a failure can be partial;
+    it is reported as a 409 with the inserted count and the failed student_ids.
+    """
+    # Parse the raw request body with orjson (much faster than the stdlib on large arrays)
+    try:
+        students_list = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return _json_response({'message': 'Invalid JSON body'}, 400)
 
     if students_list:
+        # Validate and convert every date up front, in a single pass per field
+        # (a missing or malformed date in any record rejects the whole batch)
+        try:
+            created_list = [_parse_date(student_data.get("created")) for student_data in students_list]
+            updated_list = [_parse_date(student_data.get("last_updated")) for student_data in students_list]
+        except (TypeError, ValueError):
+            return _json_response({'message': 'Invalid or missing date format in one or more student records (expected YYYY-MM-DD)'}, 400)
+
         insert_list = []
         # Loop over each student in the list
-        for student_data in students_list:
+        for student_data, _created, _lastUpdated in zip(students_list, created_list, updated_list):
             _studentId = student_data.get("student_id")
             _fName = student_data.get("first_name")
             _lName = student_data.get("last_name")
@@ -117,13 +237,6 @@ def add_students():
             _imageURL = student_data.get("image")
             _active = student_data.get("active")
             _isDeleted = student_data.get("is_deleted")
-            # Added error handling for missing date fields
-            try:
-                _created = datetime.strptime(student_data.get("created"), "%Y-%m-%d")
-                _lastUpdated = datetime.strptime(student_data.get("last_updated"), "%Y-%m-%d")
-            except (TypeError, ValueError):
-                return jsonify({'message': 'Invalid or missing date format in one or more student records (expected YYYY-MM-DD)'}), 400
-
             _createdBy = student_data.get("created_by")
             _lastUpdatedBy = student_data.get("last_updated_by")
 
@@ -147,59 +260,67 @@ def add_students():
 
         # Insert all prepared documents into the "students" database
         if insert_list:
-            mongo.db.students.insert_many(insert_list)
+            try:
+                mongo.db.students.insert_many(insert_list, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: every document without an error has been inserted regardless
+                failed = [err.get('op', {}).get('student_id') for err in e.details.get('writeErrors', [])]
+                return _json_response({'message': 'One or more students could not be inserted (e.g. duplicate student_id)',
+                                       'inserted_count': e.details.get('nInserted', 0),
+                                       'failed_student_ids': failed}, 409)
 
         # Generate a response
         response = 'Students added successfully'
-        return jsonify(response), 200
+        return _json_response(response)
     else:
         return not_found()
 
 
-# Helper function to serialize MongoDB object
-def serialize_doc(doc):
-    """Converts MongoDB document to JSON serializable dictionary."""
-    doc['_id'] = str(doc['_id'])
-    # Convert datetime objects to string format for JSON
-    for key, value in doc.items():
-        if isinstance(value, datetime):
-            doc[key] = value.strftime("%Y-%m-%d %H:%M:%S")
-    return doc
-
 # Get a student by student_id
 @app.route('/get_student/<student_id>', methods=['GET'])
 def get_single_student(student_id):
     student = mongo.db.students.find_one({'student_id': student_id})
     if student:
-        return jsonify(serialize_doc(student)), 200
+        return _json_response(student)
     else:
         return not_found()
     
 # Get all students
 @app.route('/get_students', methods=['GET'])
 def get_all_students():
-    students = list(mongo.db.students.find())
+    # Optional projection, e.g. ?fields=student_id,first_name,last_name,age
+    # Only the requested fields are sent over the wire (_id is left out unless listed)
+    try:
+        projection = _fields_projection(request.args.get('fields', ''))
+    except ValueError as e:
+        return _json_response({'message': str(e)}, 400)
+    cursor = mongo.db.students.find({}, projection)
 
-    if students:
-        # Convert ObjectId and datetime for each student
-        students_list = [serialize_doc(student) for student in students]
-        return jsonify(students_list), 200
-    else:
-        return jsonify([]), 200 # Return empty list instead of 404 for 'all'
+    try:
+        # ?format=ndjson streams one document per line as it comes off the cursor, instead of
+        # materializing the whole result set (TTFB after the first document, constant memory)
+        if request.args.get('format') == 'ndjson':
+            return _ndjson_response(cursor)
+        students = list(cursor)
+    except OperationFailure as e:
+        # Anything else the server refuses to apply (e.g. an unsupported projection)
+        return _json_response({'message': (e.details or {}).get('errmsg', str(e))}, 400)
+
+    # Return empty list instead of 404 for 'all'
+    return _json_response(students)
 
 
 # Update a student by student_id
 @app.route('/update_student/<student_id>', methods=['PUT'])
 def update_student(student_id):
     _json = request.json
-    date_format = "%Y-%m-%d"
     
     # Safely convert dates
     try:
-        created_date = datetime.strptime(_json["created"], date_format)
-        last_updated_date = datetime.strptime(_json["last_updated"], date_format)
+        created_date = _parse_date(_json["created"])
+        last_updated_date = _parse_date(_json["last_updated"])
     except (TypeError, ValueError):
-        return jsonify({'message': 'Invalid date format (expected YYYY-MM-DD)'}), 400
+        return _json_response({'message': 'Invalid date format (expected YYYY-MM-DD)'}, 400)
         
     updated_student = {
         'student_id': _json["student_id"],
@@ -214,15 +335,18 @@ def update_student(student_id):
         'last_updated': last_updated_date,
         'last_updated_by': _json["last_updated_by"]
     }
-    result = mongo.db.students.update_one(
-        {'student_id': student_id},
-        {'$set': updated_student}
-    )
+    try:
+        result = mongo.db.students.update_one(
+            {'student_id': student_id},
+            {'$set': updated_student}
+        )
+    except DuplicateKeyError:
+        return _json_response({'message': f'A student with student_id {_json["student_id"]} already exists'}, 409)
     if result.modified_count:
-        return jsonify('Student updated successfully'), 200
+        return _json_response('Student updated successfully')
     # Check if the document existed but no change was made
     elif result.matched_count:
-        return jsonify('Student found, but no changes applied'), 200
+        return _json_response('Student found, but no changes applied')
     else:
         return not_found()
 
@@ -235,7 +359,7 @@ def soft_delete_student(student_id):
         {'$set': {'is_deleted': True}}
     )
     if result.modified_count:
-        return jsonify('Student soft deleted successfully'), 200
+        return _json_response('Student soft deleted successfully')
     else:
         return not_found()
     
@@ -244,7 +368,7 @@ def soft_delete_student(student_id):
 def hard_delete_student(student_id):
     result = mongo.db.students.delete_one({'student_id': student_id})
     if result.deleted_count:
-        return jsonify('Student hard deleted successfully'), 200
+        return _json_response('Student hard deleted successfully')
     else:
         return not_found()
     
@@ -255,7 +379,7 @@ def hard_delete_student(student_id):
 def get_student_task(task_id):
     task = mongo.db.student_tasks.find_one({'task_id': task_id})
     if task:
-        return jsonify(serialize_doc(task)), 200
+        return _json_response(task)
     else:
         return not_found()
     
@@ -264,12 +388,8 @@ def get_student_task(task_id):
 def get_student_tasks(student_id):
     tasks = list(mongo.db.student_tasks.find({'student_id': student_id}))
 
-    if tasks:
-        # Convert ObjectId and datetime for each task
-        tasks_list = [serialize_doc(task) for task in tasks]
-        return jsonify(tasks_list), 200
-    else:
-        return jsonify([]), 200 # Return empty list instead of 404
+    # Return empty list instead of 404
+    return _json_response(tasks)
 
 
 # Inserting a new task (Single task) for a student
@@ -277,7 +397,6 @@ def get_student_tasks(student_id):
 def add_student_task():
     # Storing all the supplied JSON from the request
     _json = request.json
-    date_format = "%Y-%m-%d"
     
     _task_id = _json.get("task_id")
     _student_id = _json.get("student_id")
@@ -290,26 +409,29 @@ def add_student_task():
 
     # Safely convert dates
     try:
-        created_date = datetime.strptime(_created, date_format)
-        last_updated_date = datetime.strptime(last_updated, date_format)
+        created_date = _parse_date(_created)
+        last_updated_date = _parse_date(last_updated)
     except (TypeError, ValueError):
-        return jsonify({'message': 'Invalid date format (expected YYYY-MM-DD)'}), 400
+        return _json_response({'message': 'Invalid date format (expected YYYY-MM-DD)'}, 400)
         
 
     if request.method == 'POST':
-        mongo.db.student_tasks.insert_one(
-            {
-                'task_id': _task_id,
-                'student_id': _student_id,
-                'score': _score,
-                'is_deleted': _is_deleted,
-                'created': created_date,
-                'created_by': _created_by,
-                'last_updated': last_updated_date,
-                'last_updated_by': last_updated_by
-            }
-        )
-        return jsonify('Task added successfully'), 200
+        try:
+            mongo.db.student_tasks.insert_one(
+                {
+                    'task_id': _task_id,
+                    'student_id': _student_id,
+                    'score': _score,
+                    'is_deleted': _is_deleted,
+                    'created': created_date,
+                    'created_by': _created_by,
+                    'last_updated': last_updated_date,
+                    'last_updated_by': last_updated_by
+                }
+            )
+        except DuplicateKeyError:
+            return _json_response({'message': f'A task with task_id {_task_id} already exists'}, 409)
+        return _json_response('Task added successfully')
     else:
         return not_found()
     
@@ -318,14 +440,13 @@ def add_student_task():
 def update_student_task(task_id):
     #collect information from the request 
     _json = request.json
-    date_format = "%Y-%m-%d"
 
     # Safely convert dates
     try:
-        created_date = datetime.strptime(_json["created"], date_format)
-        last_updated_date = datetime.strptime(_json["last_updated"], date_format)
+        created_date = _parse_date(_json["created"])
+        last_updated_date = _parse_date(_json["last_updated"])
     except (TypeError, ValueError):
-        return jsonify({'message': 'Invalid date format (expected YYYY-MM-DD)'}), 400
+        return _json_response({'message': 'Invalid date format (expected YYYY-MM-DD)'}, 400)
 
     updated_student_task = {
         'task_id': _json["task_id"],
@@ -337,16 +458,19 @@ def update_student_task(task_id):
         'last_updated': last_updated_date,
         'last_updated_by': _json["last_updated_by"]
     }
-    result = mongo.db.student_tasks.update_one(
-        {'task_id': task_id},
-        {'$set': updated_student_task}
-    )
+    try:
+        result = mongo.db.student_tasks.update_one(
+            {'task_id': task_id},
+            {'$set': updated_student_task}
+        )
+    except DuplicateKeyError:
+        return _json_response({'message': f'A task with task_id {_json["task_id"]} already exists'}, 409)
 
     if result.modified_count:
-        return jsonify('Task updated successfully'), 200
+        return _json_response('Task updated successfully')
     # Check if the document existed but no change was made
     elif result.matched_count:
-        return jsonify('Task found, but no changes applied'), 200
+        return _json_response('Task found, but no changes applied')
     else:
         return not_found()
     
@@ -358,7 +482,7 @@ def soft_delete_student_task(task_id):
         {'$set': {'is_deleted': True}}
     )
     if result.modified_count:
-        return jsonify('Task soft deleted successfully'), 200
+        return _json_response('Task soft deleted successfully')
     else:
         return not_found()
 
@@ -367,7 +491,7 @@ def soft_delete_student_task(task_id):
 def hard_delete_student_task(task_id):
     result = mongo.db.student_tasks.delete_one({'task_id': task_id})
     if result.deleted_count:
-        return jsonify('Task hard deleted successfully'), 200
+        return _json_response('Task hard deleted successfully')
     else:
         return not_found()
 
@@ -378,7 +502,7 @@ def update_legacy_client(client_id):
     # Expect JSON mapping of attribute_pos -> value (string or list for VM)
     data = request.json
     if not data:
-        return jsonify({'message': 'Missing JSON body with attribute mapping'}), 400
+        return _json_response({'message': 'Missing JSON body with attribute mapping'}, 400)
     try:
         record = PickRecord.read(client_id)
         if not record.raw_data:
@@ -390,22 +514,23 @@ def update_legacy_client(client_id):
                 pos = int(k)
                 attr_map[pos] = v
             except Exception:
-                return jsonify({'message': f'Invalid attribute key: {k} (must be integer)'}), 400
+                return _json_response({'message': f'Invalid attribute key: {k} (must be integer)'}, 400)
         record.update(attr_map)
-        return jsonify({'message': 'Legacy record updated successfully'}), 200
+        return _json_response({'message': 'Legacy record updated successfully'})
     except Exception as e:
-        return jsonify({'message': 'Error updating legacy record', 'detail': str(e)}), 500
+        return _json_response({'message': 'Error updating legacy record', 'detail': str(e)}, 500)
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ For Error Handling ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+# Fixed 404 envelope, only the (JSON-escaped) message is filled in per request
+_NOT_FOUND_TEMPLATE = b'{"status":404,"message":%s}'
+
+
 @app.errorhandler(404)
 def not_found(error=None):
-    message = {
-        'status': 404,
-        'message': 'Not found ' + request.url
-    }
-    response = jsonify(message)
-    return response, 404
+    message = orjson.dumps('Not found ' + request.url)
+    return app.response_class(_NOT_FOUND_TEMPLATE % message, status=404, mimetype='application/json')
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only (see wsgi.py for production); debug mode is opt-in via FLASK_DEBUG=1
+    app.run(debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true'))
\ No newline at end of file
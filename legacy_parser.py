@@ -1,9 +1,66 @@
 # legacy_parser.py
 
+import json
+import mmap
 import os
 import shutil
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import zip_longest
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+
+@lru_cache(maxsize=4096)
+def _decimal_str(value):
+    """Returns the canonical Decimal string of a numeric value (or the value itself if not numeric).
+
+    Balances are only ever exposed as strings, so the Decimal round-trip is memoized per distinct
+    value instead of constructing a new Decimal for every balance of every request.
+    """
+    try:
+        return str(Decimal(value))
+    except InvalidOperation:
+        return value
+
+
+@lru_cache(maxsize=1024)
+def _parse_transactions(balances_raw, dates_raw, vm, parse_numbers, parse_dates):
+    """Parses the VM separated balances and dates attributes of a record.
+
+    Returns (balances, dates, pairs) as tuples of strings, pairs being (amount, date) per transaction.
+    Keyed on the raw attribute strings, so unchanged records are parsed once; since update()
+    produces new raw strings, invalidation is automatic.
+    """
+    balances = []
+    dates = []
+    pairs = []
+    # Single walk that parses, stringifies and pairs balances with dates into transactions.
+    # Empty values are dropped before pairing; a missing side of a pair is None.
+    for b, d in zip_longest(filter(None, balances_raw.split(vm)), filter(None, dates_raw.split(vm))):
+        if b is not None:
+            # Try to parse numeric balances when possible
+            if parse_numbers:
+                b = _decimal_str(b)
+            balances.append(b)
+        if d is not None:
+            # Try to parse dates in ISO 'YYYY-MM-DD' format
+            if parse_dates:
+                try:
+                    d = str(datetime.strptime(d, "%Y-%m-%d").date())
+                except ValueError:
+                    pass
+            dates.append(d)
+        pairs.append((str(b), str(d)))
+    return tuple(balances), tuple(dates), tuple(pairs)
 
 
 class PickRecord:
@@ -11,41 +68,254 @@ class PickRecord:
     A class that simulates a Pick/Universe Dynamic Array record.
     It provides 1-based indexing extraction logic (mimicking Unibasic).
     """
+    # A record is created per READ; slots avoid a per-instance __dict__ (class-level state is unaffected)
+    __slots__ = ('record_key', 'raw_data', 'attributes', '_vm_cache')
+
     # Define the primary Pick system delimiters as constants
     AM = '^'  # Attribute Mark (Simulates field separation)
     VM = ']'  # Value Mark (Simulates multi-value separation within a field)
     SM = '\\'  # SubValue Mark (Simulates nested values within a value)
+    # Bytes counterpart of AM, for byte-level scanning of DATA_FILE
+    AM_B = b'^'
     
     # Path to the simulated legacy data file
     # os.path.dirname(__file__) ensures the file path is correct relative to this module
     DATA_FILE = os.path.join(os.path.dirname(__file__), 'LEGACY_CLIENTS.dat')
 
+    # In-memory key index of DATA_FILE: {record_key: (byte_offset, line_length, raw_attributes)}
+    # Keys and raw attributes are kept as undecoded bytes; a record is decoded only when read.
+    # Rebuilt only when the data file changes (modification time, size or inode)
+    _index = None
+    _index_stamp = None
+    _index_path = None
+    # Guards the index and writes to DATA_FILE across threads. Writers also flock DATA_FILE.lock
+    # exclusively and index rebuilds take it shared, so several worker processes (e.g. gunicorn
+    # -w 4) neither interleave their writes nor index a half-written record
+    _lock = threading.Lock()
+    # Bytes of DATA_FILE occupied by tombstoned (blanked-out) record slots
+    _tombstone_bytes = 0
+    # Line terminator of DATA_FILE (taken from its first line), used for appended records
+    _newline = b'\n'
+    # Serialized to_json() output: {record_key: (raw_attributes, {(parse_numbers, parse_dates, latest_balance): bytes})}
+    # Entries are tied to the raw bytes they were built from; cleared whenever the index is rebuilt
+    _json_cache = {}
+
     def __init__(self, record_key=None, raw_data=None):
         self.record_key = record_key
         self.raw_data = raw_data
         self.attributes = []
+        # Memoized VM splits of attributes, keyed by 0-based attribute index
+        self._vm_cache = {}
         if raw_data:
             # Split the raw string into attributes using the Attribute Mark (AM)
             self.attributes = raw_data.split(self.AM)
 
+    @classmethod
+    @contextmanager
+    def _locked(cls, file_lock=False):
+        """Holds the class lock, plus an exclusive flock on DATA_FILE.lock when file_lock is set."""
+        with cls._lock:
+            if not file_lock:
+                yield
+                return
+            with cls._flock(exclusive=True):
+                yield
+
+    @classmethod
+    @contextmanager
+    def _flock(cls, exclusive):
+        """Holds a flock on DATA_FILE.lock: exclusive for writers, shared for index rebuilds.
+
+        The flock is taken on a side file because compact() replaces DATA_FILE itself. Without
+        fcntl (Windows) only the class lock applies.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(cls.DATA_FILE + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _stamp(st):
+        """Identifies a version of DATA_FILE; size and inode catch changes within one mtime tick."""
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @classmethod
+    def _load_index(cls):
+        """Loads (or refreshes) the key index so lookups avoid re-scanning the flat file.
+
+        Returns the index itself: callers should use that reference rather than re-reading
+        cls._index, which a concurrent update() may replace.
+        """
+        with cls._locked():
+            return cls._refresh_index(file_lock=True)
+
+    @classmethod
+    def _refresh_index(cls, file_lock=False):
+        """_load_index() for callers already holding the lock.
+
+        With file_lock set, a rebuild holds a shared flock on DATA_FILE.lock, so it never scans
+        a record that another worker's update() is halfway through writing. Callers that hold
+        the exclusive flock (update(), compact()) leave it unset.
+        """
+        stamp = cls._stamp(os.stat(cls.DATA_FILE))
+        if cls._index is not None and cls._index_path == cls.DATA_FILE and cls._index_stamp == stamp:
+            return cls._index
+        if not file_lock:
+            return cls._build_index()
+        with cls._flock(exclusive=False):
+            return cls._build_index()
+
+    @classmethod
+    def _build_index(cls):
+        """Scans DATA_FILE into a new key index and installs it."""
+        index = {}
+        tombstone_bytes = 0
+        newline = None
+        with open(cls.DATA_FILE, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            # mmap cannot map an empty file
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:
+            am = cls.AM_B
+            start = 0
+            # Scan line boundaries and the first AM of each line with bytes.find (C-level search)
+            while start < size:
+                line_end = buf.find(b'\n', start)
+                if line_end == -1:
+                    line_end = end = size
+                else:
+                    end = line_end + 1
+                # Drop the line terminator by offset instead of strip()-ing every line
+                if line_end > start and buf[line_end - 1] == 0x0D:  # '\r' of a CRLF terminator
+                    line_end -= 1
+                if newline is None and end > line_end:
+                    newline = bytes(buf[line_end:end])
+                sep = buf.find(am, start, line_end)
+                if sep != -1:
+                    # Split the line once by AM: '101^John Doe...' -> ('101', 'John Doe...')
+                    key = buf[start:sep].lstrip()
+                    if key:
+                        # update() appends rewritten records, so the last occurrence of a key wins
+                        index[key] = (start, end - start, buf[sep + 1:line_end])
+                elif cls._is_tombstone(buf[start:end]):
+                    tombstone_bytes += end - start
+                start = end
+        finally:
+            if size:
+                buf.close()
+        cls._index = index
+        cls._index_stamp = cls._stamp(st)
+        cls._index_path = cls.DATA_FILE
+        cls._tombstone_bytes = tombstone_bytes
+        cls._newline = newline or b'\n'
+        cls._json_cache = {}
+        return index
+
+    @staticmethod
+    def _is_tombstone(line):
+        """A tombstoned slot is a line blanked out with spaces by update()."""
+        return not line.strip() and bool(line.rstrip(b'\r\n'))
+
+    @classmethod
+    def compact(cls):
+        """Rewrites DATA_FILE without the tombstoned slots left behind by update()."""
+        with cls._locked(file_lock=True):
+            cls._compact()
+
+    @classmethod
+    def _compact(cls):
+        """compact() for callers already holding the file lock."""
+        data_dir = os.path.dirname(os.path.abspath(cls.DATA_FILE))
+        fd, tmp_file = tempfile.mkstemp(dir=data_dir, prefix=os.path.basename(cls.DATA_FILE) + '.')
+        try:
+            with open(cls.DATA_FILE, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                for line in src:
+                    if not cls._is_tombstone(line):
+                        dst.write(line)
+            # mkstemp creates the file as 0600, keep the data file's permissions
+            os.chmod(tmp_file, stat.S_IMODE(os.stat(cls.DATA_FILE).st_mode))
+            os.replace(tmp_file, cls.DATA_FILE)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        # Offsets have moved, rebuild the index right away so it is never left unset
+        cls._index = None
+        cls._refresh_index()
+
+    @classmethod
+    def _backup(cls):
+        """Copies DATA_FILE to DATA_FILE.bak.
+
+        copy_file_range lets the kernel copy without going through userspace, and turns the copy
+        into an O(1) reflink on copy-on-write filesystems (Btrfs, XFS). A hardlink is not an option:
+        update() patches DATA_FILE in place, which would modify a linked backup as well.
+        """
+        bak_file = cls.DATA_FILE + '.bak'
+        try:
+            with open(cls.DATA_FILE, 'rb') as src, open(bak_file, 'wb') as dst:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            if remaining <= 0:
+                return
+        except (AttributeError, OSError):
+            # copy_file_range is Linux only and may be unsupported across filesystems
+            pass
+        shutil.copy(cls.DATA_FILE, bak_file)
+
     @classmethod
     def read(cls, record_key):
         """Simulates the Unibasic 'READ' statement, retrieving a record by its key."""
         try:
-            with open(cls.DATA_FILE, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    # A Pick record is identified by its key at the beginning of the line
-                    # The line must be non-empty and start with the key followed by the delimiter
-                    if line and line.startswith(f"{record_key}{cls.AM}"):
-                        # Split the line once by AM and take the second part (the raw attributes)
-                        # e.g., '101^John Doe...' -> 'John Doe...'
-                        raw_attributes = line.split(cls.AM, 1)[1]
-                        return cls(record_key, raw_attributes)
-            return cls(record_key, None) # Record not found
+            index = cls._load_index()
         except FileNotFoundError:
             print(f"Error: Legacy data file not found at {cls.DATA_FILE}")
             return cls(record_key, None)
+        # Returns a record with raw_data None when the key is not found
+        entry = index.get(str(record_key).encode())
+        return cls(record_key, entry[2].decode() if entry else None)
+
+    @classmethod
+    def read_json(cls, record_key, parse_numbers=True, parse_dates=True, latest_balance='last'):
+        """READs a record and returns its to_json() output encoded as JSON bytes (None if not found).
+
+        The encoded output is cached per record contents and options, so repeated reads of an
+        unchanged record skip building the PickRecord and its JSON entirely.
+        """
+        try:
+            index = cls._load_index()
+        except FileNotFoundError:
+            print(f"Error: Legacy data file not found at {cls.DATA_FILE}")
+            return None
+        key = str(record_key)
+        entry = index.get(key.encode())
+        if not entry or not entry[2]:
+            return None # Record not found
+        raw = entry[2]
+        # Anything but 'first' behaves as 'last' in to_json()
+        options = (parse_numbers, parse_dates, 'first' if latest_balance == 'first' else 'last')
+        # A cached body is only valid for the raw bytes it was built from, so a record rewritten
+        # by update() (in this or another thread) is never served from a stale entry
+        cached = cls._json_cache.get(key)
+        if cached is None or cached[0] != raw:
+            cached = (raw, {})
+            cls._json_cache[key] = cached
+        body = cached[1].get(options)
+        if body is None:
+            data = cls(key, raw.decode()).to_json(*options)
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+            cached[1][options] = body
+        return body
 
     def extract(self, attribute_pos, value_pos=None, subvalue_pos=None):
         """
@@ -65,7 +335,10 @@ class PickRecord:
 
                 if value_pos:
                     # Handle Multi-Values (VM delimiter)
-                    values = attr.split(self.VM)
+                    values = self._vm_cache.get(attr_index)
+                    if values is None:
+                        values = attr.split(self.VM)
+                        self._vm_cache[attr_index] = values
                     value_index = value_pos - 1
                     if 0 <= value_index < len(values):
                         # Handle SubValues if required
@@ -92,56 +365,28 @@ class PickRecord:
             return None # Record not found
 
         # Convert and type cast dynamic-array fields into structured JSON
-        balances_raw = self.extract(2)
-        dates_raw = self.extract(3)
-
-        balances = [b for b in (balances_raw.split(self.VM) if balances_raw else []) if b != '']
-        dates = [d for d in (dates_raw.split(self.VM) if dates_raw else []) if d != '']
+        # Attribute 2: Balances, Attribute 3: Transaction dates (both VM separated)
+        attrs = self.attributes
+        balances_raw = attrs[1] if len(attrs) > 1 else ''
+        dates_raw = attrs[2] if len(attrs) > 2 else ''
 
-        # Try to parse numeric balances when possible
-        parsed_balances = []
-        for b in balances:
-            try:
-                parsed_balances.append(Decimal(b) if parse_numbers else b)
-            except (InvalidOperation, TypeError):
-                parsed_balances.append(b)
-
-        # Try to parse dates in ISO 'YYYY-MM-DD' format
-        parsed_dates = []
-        for d in dates:
-            try:
-                parsed_dates.append(datetime.strptime(d, "%Y-%m-%d").date() if parse_dates else d)
-            except (ValueError, TypeError):
-                parsed_dates.append(d)
-
-        # Pair up balances and dates into transactions list
-        transactions = []
-        length = max(len(parsed_balances), len(parsed_dates))
-        for i in range(length):
-            tx = {}
-            if i < len(parsed_balances):
-                tx["amount"] = parsed_balances[i]
-            if i < len(parsed_dates):
-                tx["date"] = parsed_dates[i]
-            transactions.append(tx)
+        balances, dates, pairs = _parse_transactions(balances_raw, dates_raw, self.VM,
+                                                     parse_numbers, parse_dates)
 
         # Support choice for latest semantics: 'last' or 'first'
-        if parsed_balances:
-            if latest_balance == 'first':
-                current_balance = parsed_balances[0]
-            else:
-                current_balance = parsed_balances[-1]
+        if balances:
+            current_balance = balances[0] if latest_balance == 'first' else balances[-1]
         else:
             current_balance = None
 
         return {
             "client_id": self.record_key,
             "client_name": self.extract(1),  # Attribute 1: Name
-            "current_balance": str(current_balance) if current_balance is not None else None,
-            "legacy_balances_history": [str(x) for x in parsed_balances],
-            "transaction_dates": [str(x) for x in parsed_dates],
-            "transactions": [{"amount": str(t.get('amount')), "date": str(t.get('date'))}
-                              for t in transactions],
+            "current_balance": current_balance,
+            # Copy the cached tuples so callers can't mutate the shared parse result
+            "legacy_balances_history": list(balances),
+            "transaction_dates": list(dates),
+            "transactions": [{"amount": a, "date": d} for a, d in pairs],
             "data_source": "Simulated Universe/Pick Flat File"
         }
 
@@ -149,8 +394,10 @@ class PickRecord:
         """Update attributes for this record in the flat file.
 
         attribute_map: dict: keys are attribute positions (1-based ints), values are either string
-        or lists (for VM). This function will build an updated attribute string and replace the
-        existing record line in the data file.
+        or lists (for VM). This function will build an updated attribute string and patch the
+        existing record line in place when its length is unchanged (or it is the last line);
+        otherwise the old line is blanked out (tombstoned) and the record is appended to the end
+        of the data file. Line terminators (LF or CRLF) are preserved.
         """
         if not self.record_key:
             raise ValueError("No record_key available to update")
@@ -170,21 +417,65 @@ class PickRecord:
 
         new_raw = self.AM.join(attrs)
 
-        # Ensure we create a backup before modifying (safety)
-        bak_file = self.DATA_FILE + '.bak'
-        shutil.copy(self.DATA_FILE, bak_file)
-
-        updated_line = f"{self.record_key}{self.AM}{new_raw}\n"
-        # Rebuild file by replacing the matched line
-        with open(self.DATA_FILE, 'r') as f:
-            lines = f.readlines()
-        with open(self.DATA_FILE, 'w') as f:
-            for line in lines:
-                if line.strip().startswith(f"{self.record_key}{self.AM}"):
-                    f.write(updated_line)
+        cls = type(self)
+        key = str(self.record_key)
+        key_b = key.encode()
+        raw_b = new_raw.encode()
+        record = key_b + self.AM_B + raw_b
+
+        with cls._locked(file_lock=True):
+            # Optional full-file backup before modifying (set UNIBRIDGE_BACKUP=1 to enable)
+            if os.environ.get('UNIBRIDGE_BACKUP'):
+                cls._backup()
+
+            # Reload under the lock: another thread or worker may have moved records since our READ
+            index = cls._refresh_index()
+
+            # Only the bytes of this record are written, never the whole file
+            fd = os.open(self.DATA_FILE, os.O_RDWR)
+            try:
+                entry = index.get(key_b)
+                file_size = os.fstat(fd).st_size
+                in_place = False
+                if entry:
+                    old_offset, old_length, _ = entry
+                    old_line = os.pread(fd, old_length, old_offset)
+                    old_body_length = len(old_line.rstrip(b'\r\n'))
+                    # Keep the slot's own terminator: CRLF, LF, or none for an unterminated last line
+                    updated_line = record + old_line[old_body_length:]
+                    # Same length, or the last line of the file (free to grow or shrink)
+                    in_place = len(updated_line) == old_length or old_offset + old_length == file_size
+                if in_place:
+                    # Patch the record in place
+                    offset = old_offset
                 else:
-                    f.write(line)
+                    if entry:
+                        # Tombstone the old slot with spaces, keeping its line terminator
+                        os.pwrite(fd, b' ' * old_body_length, old_offset)
+                        cls._tombstone_bytes += old_length
+                    # Append the rewritten record at EOF, using the file's line terminator
+                    newline = cls._newline
+                    updated_line = record + newline
+                    offset = file_size
+                    if offset and os.pread(fd, 1, offset - 1) != b'\n':
+                        os.pwrite(fd, newline, offset)
+                        offset += len(newline)
+                os.pwrite(fd, updated_line, offset)
+                if in_place and len(updated_line) < old_length:
+                    # A shrunk last line: drop the old tail only once the new record is written
+                    os.ftruncate(fd, offset + len(updated_line))
+                # Keep the key index in sync with the file we just wrote
+                index[key_b] = (offset, len(updated_line), raw_b)
+                st = os.fstat(fd)
+                cls._index_stamp = cls._stamp(st)
+            finally:
+                os.close(fd)
+
+            # Compact lazily, once tombstones take up half of the file
+            if cls._tombstone_bytes * 2 > st.st_size:
+                cls._compact()
 
         # Update our in-memory raw_data and attributes
         self.raw_data = new_raw
         self.attributes = new_raw.split(self.AM)
+        self._vm_cache.clear()
@@ -1,7 +1,11 @@
+import json
+import multiprocessing
 import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 from datetime import date
 from decimal import Decimal
 
@@ -87,3 +91,250 @@ def test_update_and_readback(tmp_path):
     rec2 = PickRecord.read('102')
     assert rec2.extract(1) == 'Jane Doe'
     assert rec2.extract(2, 1) == '999.99'
+
+
+def test_read_refreshes_index_when_file_changes(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+
+    assert PickRecord.read('105').raw_data is None
+    with open(test_file, 'a') as f:
+        f.write("105^New Client^10.00^2024-07-01\n")
+    os.utime(test_file, ns=(0, os.stat(test_file).st_mtime_ns + 1))
+
+    rec = PickRecord.read('105')
+    assert rec.extract(1) == 'New Client'
+
+
+def test_update_in_place_and_append(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    size_before = os.path.getsize(test_file)
+
+    # Same length: patched in place, file size unchanged
+    rec = PickRecord.read('103')
+    rec.update({1: 'Alex Chan'})
+    assert os.path.getsize(test_file) == size_before
+
+    # Length change: old slot tombstoned, record appended
+    rec = PickRecord.read('101')
+    rec.update({1: 'John Q. Doe'})
+    with open(test_file) as f:
+        lines = f.read().splitlines()
+    assert lines[0].strip() == ''
+    assert lines[-1].startswith('101^John Q. Doe^')
+
+    # A freshly built index sees the same records
+    PickRecord._index = None
+    assert PickRecord.read('101').extract(1) == 'John Q. Doe'
+    assert PickRecord.read('103').extract(1) == 'Alex Chan'
+    assert PickRecord.read('104').extract(1) == 'Lisa Wong'
+
+
+def test_compact_drops_tombstones(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+
+    rec = PickRecord.read('102')
+    rec.update({1: 'Jane Q. Smith'})
+    PickRecord.compact()
+    with open(test_file) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 4
+    assert all(line.strip() for line in lines)
+    assert PickRecord.read('102').extract(1) == 'Jane Q. Smith'
+
+
+def test_concurrent_updates_keep_file_consistent(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    keys = ['101', '102', '103', '104']
+    errors = []
+
+    def worker(key):
+        try:
+            # Alternating name lengths force tombstones, appends and compactions
+            for i in range(50):
+                PickRecord.read(key).update({1: f"Client {key} " + 'x' * (i % 7)})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in keys for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    PickRecord._index = None
+    with open(test_file) as f:
+        live = [line for line in f.read().splitlines() if line.strip()]
+    assert sorted(line.split('^', 1)[0] for line in live) == keys
+    for key in keys:
+        assert PickRecord.read(key).extract(1).startswith(f"Client {key} ")
+        assert PickRecord.read(key).extract(2) != ''
+
+
+def _update_in_process(data_file, key):
+    PickRecord.DATA_FILE = data_file
+    for i in range(50):
+        PickRecord.read(key).update({1: f"Client {key} " + 'x' * (i % 7)})
+
+
+def test_concurrent_processes_keep_file_consistent(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    keys = ['101', '102', '103', '104']
+
+    # Separate processes only share the flock on DATA_FILE.lock, as gunicorn workers do
+    procs = [multiprocessing.Process(target=_update_in_process, args=(test_file, k)) for k in keys]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    assert [p.exitcode for p in procs] == [0] * len(procs)
+    with open(test_file) as f:
+        live = [line for line in f.read().splitlines() if line.strip()]
+    assert sorted(line.split('^', 1)[0] for line in live) == keys
+    for key in keys:
+        assert PickRecord.read(key).extract(1).startswith(f"Client {key} ")
+        assert PickRecord.read(key).extract(2) != ''
+
+
+def _read_in_process(data_file, key, reading, expected_name):
+    PickRecord.DATA_FILE = data_file
+    reading.set()
+    sys.exit(0 if PickRecord.read(key).extract(1) == expected_name else 1)
+
+
+def test_index_rebuild_waits_for_writer_in_other_process(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    with open(test_file, 'rb') as f:
+        line = f.read().splitlines(keepends=True)[1]
+
+    reading = multiprocessing.Event()
+    reader = multiprocessing.Process(target=_read_in_process,
+                                     args=(test_file, '102', reading, 'Jane Q. Smith'))
+    # Hold the writers' flock with record 102 half-moved, as another worker's update() leaves it
+    # between tombstoning the old slot and appending the new one
+    with PickRecord._flock(exclusive=True):
+        with open(test_file, 'r+b') as f:
+            f.seek(f.read().index(line))
+            f.write(b' ' * (len(line) - 1))
+        reader.start()
+        reading.wait()
+        time.sleep(0.2)
+        with open(test_file, 'ab') as f:
+            f.write(line.replace(b'Jane Smith', b'Jane Q. Smith'))
+    reader.join()
+
+    assert reader.exitcode == 0
+
+
+def setup_crlf_test_data(tmp_path):
+    # Same layout as the shipped LEGACY_CLIENTS.dat: CRLF terminators, last line unterminated
+    dst = tmp_path / 'LEGACY_CLIENTS_crlf.dat'
+    dst.write_bytes(
+        b"101^John Doe^2500.00]400.00]12.50^2023-11-01]2023-12-01]2024-01-15\r\n"
+        b"102^Jane Smith^150.00]800.00^2024-02-10]2024-03-15\r\n"
+        b"103^Alex Chen^9800.00^^2024-04-20\r\n"
+        b"104^Lisa Wong^100.00]50.00^2024-05-01]2024-05-15]2024-06-01]2024-06-15"
+    )
+    return str(dst)
+
+
+def test_update_preserves_crlf_line_endings(tmp_path):
+    test_file = setup_crlf_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    with open(test_file, 'rb') as f:
+        original = f.read()
+
+    # Same length: patched in place, CRLF kept
+    PickRecord.read('103').update({1: 'Alex Chan'})
+    with open(test_file, 'rb') as f:
+        data = f.read()
+    assert len(data) == len(original)
+    assert b"103^Alex Chan^9800.00^^2024-04-20\r\n" in data
+
+    # Length change: appended with the file's CRLF terminator
+    PickRecord.read('101').update({1: 'John Q. Doe'})
+    with open(test_file, 'rb') as f:
+        data = f.read()
+    assert data.count(b'\n') == data.count(b'\r\n')
+    assert data.endswith(b"101^John Q. Doe^2500.00]400.00]12.50^2023-11-01]2023-12-01]2024-01-15\r\n")
+
+    PickRecord._index = None
+    assert PickRecord.read('101').extract(1) == 'John Q. Doe'
+    assert PickRecord.read('103').extract(1) == 'Alex Chan'
+    assert PickRecord.read('104').extract(3, 4) == '2024-06-15'
+
+
+def test_update_last_line_in_place(tmp_path):
+    test_file = setup_crlf_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    with open(test_file, 'rb') as f:
+        original = f.read()
+
+    # The unterminated last record grows and shrinks in place, without tombstones
+    PickRecord.read('104').update({1: 'Lisa Wong-Smith'})
+    PickRecord.read('104').update({1: 'Lisa W'})
+    with open(test_file, 'rb') as f:
+        data = f.read()
+    assert data == original.replace(b'Lisa Wong', b'Lisa W')
+
+
+def test_extract_after_update_uses_new_values(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+
+    rec = PickRecord.read('104')
+    assert rec.extract(2, 2) == '50.00'
+    rec.update({2: ['100.00', '75.00']})
+    assert rec.extract(2, 2) == '75.00'
+
+
+def test_read_json_cached_until_update(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+
+    body = PickRecord.read_json('102', latest_balance='first')
+    assert json.loads(body) == PickRecord.read('102').to_json(latest_balance='first')
+    assert PickRecord.read_json('102', latest_balance='first') is body
+    assert PickRecord.read_json('999') is None
+
+    PickRecord.read('102').update({2: ['1.00', '2.00']})
+    assert json.loads(PickRecord.read_json('102'))['current_balance'] == '2.00'
+
+
+def test_read_json_ignores_body_cached_for_old_raw(tmp_path):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+
+    old_body = PickRecord.read_json('102')
+    PickRecord.read('102').update({1: 'Jane Q. Smith'})
+    # A reader that built its body from the pre-update entry stores it after the update
+    PickRecord._json_cache['102'] = (b'Jane Smith^150.00]800.00^2024-02-10]2024-03-15',
+                                     {(True, True, 'last'): old_body})
+    assert json.loads(PickRecord.read_json('102'))['client_name'] == 'Jane Q. Smith'
+
+
+def test_update_backup_only_when_enabled(tmp_path, monkeypatch):
+    test_file = setup_test_data(tmp_path)
+    PickRecord.DATA_FILE = test_file
+    with open(test_file) as f:
+        original = f.read()
+
+    monkeypatch.delenv('UNIBRIDGE_BACKUP', raising=False)
+    PickRecord.read('103').update({1: 'Alex Chan'})
+    assert not os.path.exists(test_file + '.bak')
+
+    monkeypatch.setenv('UNIBRIDGE_BACKUP', '1')
+    with open(test_file) as f:
+        before_update = f.read()
+    PickRecord.read('103').update({1: 'Alex Chen'})
+    with open(test_file + '.bak') as f:
+        assert f.read() == before_update
+    with open(test_file) as f:
+        assert f.read() == original
@@ -0,0 +1,18 @@
+# wsgi.py
+
+"""
+WSGI entrypoint for running the API under a production server.
+
+The Werkzeug development server started by `python app.py` handles one request at a time, so a
+slow MongoDB round-trip blocks every other endpoint. Run the app with gunicorn instead:
+
+    gunicorn -w 4 -k gthread --threads 8 wsgi:app
+
+PyMongo's client is thread-safe, so gthread workers give workers x threads concurrent requests
+without any code changes.
+"""
+
+from app import app
+
+if __name__ == '__main__':
+    app.run()